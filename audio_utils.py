@@ -1,7 +1,21 @@
+import functools
+import math
 import torch
-import torchaudio
+import torch.nn.functional as F
 from torchaudio import transforms
 import random
+from typing import Optional
+import soundfile as sf
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+try:
+    from scipy import signal as scipy_signal
+except ImportError:
+    scipy_signal = None
 
 class AudioData:
     def __init__(self, signal, sample_rate):
@@ -12,73 +26,93 @@ class AudioData:
         return f"AudioData(sample_rate={self.sample_rate}Hz, signal_shape={self.signal.shape})"
 
 # Audio processing parameters
-new_channel = 2  # Convert all audio to stereo
+new_channel = 2  # Number of channels the model expects
 new_sr = 16000  # Target sample rate
 max_ms = 10000  # Maximum audio length in milliseconds
 
-def rechannel(audio_data: AudioData, new_channel: int) -> AudioData:
-    """Convert audio to the desired number of channels"""
-    if audio_data.signal.shape[0] == new_channel:
-        return audio_data
-    
-    if new_channel == 1:
-        resig = audio_data.signal[:1, :]
-    else:
-        resig = torch.cat([audio_data.signal, audio_data.signal])
-    
-    return AudioData(resig, audio_data.sample_rate)
+@functools.lru_cache(maxsize=8)
+def _get_resampler(orig_sr: int, newsr: int, dtype: torch.dtype, device: torch.device) -> transforms.Resample:
+    """Build (once) the Resample module for a given rate conversion"""
+    return transforms.Resample(orig_sr, newsr, dtype=dtype).to(device)
 
 def resample(audio_data: AudioData, newsr: int) -> AudioData:
     """Resample audio to the target sample rate"""
     if audio_data.sample_rate == newsr:
         return audio_data
     
-    num_channels = audio_data.signal.shape[0]
-    resig = torchaudio.transforms.Resample(audio_data.sample_rate, newsr)(audio_data.signal[:1, :])
+    signal = audio_data.signal
+    if soxr is not None and signal.device.type == 'cpu':
+        # libsoxr expects (time, channels) and is faster than the torch kernels
+        out = soxr.resample(signal.numpy().T, audio_data.sample_rate, newsr, quality='HQ')
+        return AudioData(torch.from_numpy(out.T.copy()), newsr)
+    
+    if scipy_signal is not None and signal.device.type == 'cpu':
+        # Polyphase FIR filter, no kernel to build and cache per rate pair
+        gcd = math.gcd(newsr, audio_data.sample_rate)
+        out = scipy_signal.resample_poly(signal.numpy(), newsr // gcd, audio_data.sample_rate // gcd, axis=-1)
+        return AudioData(torch.from_numpy(out.astype('float32', copy=False)), newsr)
     
-    if num_channels > 1:
-        retwo = torchaudio.transforms.Resample(audio_data.sample_rate, newsr)(audio_data.signal[1:, :])
-        resig = torch.cat([resig, retwo])
+    resampler = _get_resampler(audio_data.sample_rate, newsr, signal.dtype, signal.device)
+    # Resample works on (channels, time) directly, so all channels go through one conv
+    resig = resampler(signal)
     
     return AudioData(resig, newsr)
 
-def pad_trunc(audio_data: AudioData, max_ms: int) -> AudioData:
-    """Pad or truncate audio to the target length"""
-    num_rows, sig_len = audio_data.signal.shape
+def pad_trunc(audio_data: AudioData, max_ms: int, training: bool = False) -> AudioData:
+    """Pad or truncate audio to the target length (random padding split only when training)"""
+    sig_len = audio_data.signal.shape[1]
     max_len = audio_data.sample_rate // 1000 * max_ms
 
     if sig_len > max_len:
         sig = audio_data.signal[:, :max_len]
     elif sig_len < max_len:
-        pad_begin_len = random.randint(0, max_len - sig_len)
+        if training:
+            pad_begin_len = random.randint(0, max_len - sig_len)
+        else:
+            pad_begin_len = (max_len - sig_len) // 2
         pad_end_len = max_len - sig_len - pad_begin_len
-        pad_begin = torch.zeros((num_rows, pad_begin_len))
-        pad_end = torch.zeros((num_rows, pad_end_len))
-        sig = torch.cat((pad_begin, audio_data.signal, pad_end), 1)
+        # Single allocation with the signal copied into the middle
+        sig = F.pad(audio_data.signal, (pad_begin_len, pad_end_len))
     else:
         sig = audio_data.signal
     
     return AudioData(sig, audio_data.sample_rate)
 
-def process_audio(audio_data: AudioData) -> AudioData:
-    """Process audio with all transformations"""
-    # Convert to stereo
-    audio_data = rechannel(audio_data, new_channel)
+def process_audio(audio_data: AudioData, training: bool = False) -> AudioData:
+    """
+    Process audio with all transformations, allocating only the resampled and padded signals.
+    Mono audio is kept mono: its spectogram is shared across the model channels.
+    """
+    signal = audio_data.signal
+    
+    # Drop extra channels before resampling so they cost nothing
+    if signal.shape[0] > new_channel:
+        signal = signal[:new_channel, :]
     
     # Resample to target sample rate
-    audio_data = resample(audio_data, new_sr)
+    resig = resample(AudioData(signal, audio_data.sample_rate), new_sr).signal
     
     # Pad or truncate to fixed length
-    audio_data = pad_trunc(audio_data, max_ms)
-    
-    return audio_data
+    return pad_trunc(AudioData(resig, new_sr), max_ms, training)
 
-def open_audio_file(audio_path: str) -> AudioData:
-    """Load an audio file and return AudioData object"""
+def open_audio_file(audio_path: str, max_ms: Optional[int] = None) -> AudioData:
+    """Load an audio file and return AudioData object, decoding at most max_ms of it"""
     try:
-        signal, sample_rate = torchaudio.load(audio_path, backend="soundfile")
+        with sf.SoundFile(audio_path) as audio_file:
+            sample_rate = audio_file.samplerate
+            frames = audio_file.frames
+            if max_ms is not None:
+                # Anything past max_ms is truncated later, so don't decode it
+                frames = min(frames, -(-max_ms * sample_rate // 1000))
+            
+            # Decode straight into a preallocated (time, channels) tensor through libsndfile
+            buffer = torch.empty((frames, audio_file.channels), dtype=torch.float32)
+            frames_read = len(audio_file.read(out=buffer.numpy()))
+        
+        # (channels, time) view of the buffer, no transpose copy
+        signal = buffer[:frames_read].t()
         return AudioData(signal, sample_rate)
     except Exception as e:
         print(f"Error loading audio file: {audio_path}")
         print(f"Error details: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
\ No newline at end of file
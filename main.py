@@ -1,12 +1,20 @@
+import functools
 import gradio as gr
+import hashlib
 import os
 import tempfile
 from pathlib import Path
 import random
 import shutil
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 from audio_utils import (
     AudioData, 
     process_audio, 
@@ -16,7 +24,7 @@ from audio_utils import (
     max_ms
 )
 from spectogram_utils import create_spectogram
-from model import AudioEmotionCNN, load_model
+from model import AudioEmotionCNN, load_model, optimize_model
 
 # Emotion labels and their stress weights
 EMOTION_WEIGHTS = {
@@ -32,9 +40,28 @@ EMOTION_WEIGHTS = {
 
 EMOTION_LABELS = list(EMOTION_WEIGHTS.keys())
 
+# Device used for inference
+DEVICE = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+# Files per inference call; smaller batches are padded so compiled graphs see one static shape
+INFER_BATCH_SIZE = 8
+
+# Samples per processed signal
+MAX_LEN = new_sr // 1000 * max_ms
+
+# Whether torch.compile works on this interpreter, and the errors it raises itself
+try:
+    import torch._dynamo
+    from torch._dynamo.exc import TorchDynamoException
+    COMPILE_SUPPORTED = torch._dynamo.is_dynamo_supported()
+    COMPILE_ERRORS = (TorchDynamoException,)
+except (ImportError, AttributeError):
+    COMPILE_SUPPORTED = False
+    COMPILE_ERRORS = ()
+
 # Load the model at startup
 try:
-    MODEL = load_model('audio_emotion_model.pth')
+    MODEL = load_model('audio_emotion_model.pth').to(DEVICE)
 except Exception as e:
     print(f"Warning: Could not load model: {str(e)}")
     MODEL = None
@@ -42,6 +69,9 @@ except Exception as e:
 # Dictionary to store analyzed results
 ANALYZED_FILES: Dict[str, str] = {}
 
+# Model predictions by decoded audio content, so identical audio is never analyzed twice
+ANALYZED_CONTENT: Dict[str, str] = {}
+
 def calculate_stress_level(emotions):
     """
     Calculate average stress level from a list of emotions
@@ -65,52 +95,180 @@ def calculate_stress_level(emotions):
     
     return avg_stress, description
 
-def simulate_emotion_classification(audio_path):
+def infer(model, batch, channel_index):
+    """
+    Turn waveform rows on device into predicted emotion indices
+    """
+    # Create spectograms on device, one mel computation per row
+    spectogram = create_spectogram(AudioData(batch, new_sr), channel_index=channel_index)
+    
+    # Normalize each spectogram on its own (same as in training), one reduction for both stats
+    inputs_s, inputs_m = torch.std_mean(spectogram, dim=(1, 2, 3), keepdim=True)
+    spectogram = (spectogram - inputs_m) / inputs_s
+    
+    # Get model predictions, in half precision on GPU (weights stay FP32 under autocast)
+    use_autocast = DEVICE.type == "cuda"
+    with torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16, enabled=use_autocast):
+        outputs = model(spectogram)
+    
+    return torch.argmax(outputs, dim=1)
+
+def example_batch():
+    """
+    All-silent batch of the one shape classify_signals ever passes to inference
+    """
+    batch = torch.zeros((INFER_BATCH_SIZE * new_channel, MAX_LEN), device=DEVICE)
+    channel_index = torch.zeros((INFER_BATCH_SIZE, new_channel), dtype=torch.long, device=DEVICE)
+    return batch, channel_index
+
+def trace_inference():
+    """
+    Inference with the model traced and frozen by TorchScript, for when torch.compile is not usable
+    """
+    batch, channel_index = example_batch()
+    example_input = create_spectogram(AudioData(batch, new_sr), channel_index=channel_index)
+    return functools.partial(infer, optimize_model(MODEL, example_input))
+
+def build_inference():
+    """
+    Compile infer for the fixed batch shape and warm it up, so no request pays for compilation
+    """
+    if COMPILE_SUPPORTED:
+        try:
+            compiled_infer = functools.partial(
+                torch.compile(infer, mode="reduce-overhead", dynamic=False),
+                MODEL
+            )
+            with torch.inference_mode():
+                compiled_infer(*example_batch())
+            return compiled_infer
+        except (RuntimeError, *COMPILE_ERRORS) as e:
+            # Only a dummy batch runs here, so any failure means compilation is unusable
+            print(f"Warning: Could not compile inference, using TorchScript model: {str(e)}")
+    
+    return trace_inference()
+
+# Build the inference function at startup
+INFER = build_inference() if MODEL is not None else None
+
+def classify_signals(signals):
     """
-    Classify emotion using the pretrained model
+    Classify a list of processed waveforms in fixed-size batches
     """
-    # Check if file was already analyzed
-    if audio_path in ANALYZED_FILES:
-        return ANALYZED_FILES[audio_path]
+    global INFER
+    
+    if INFER is None:
+        raise RuntimeError("Model is not loaded")
     
-    try:
-        # Load and process the audio file
-        audio_data = open_audio_file(audio_path)
-        processed_audio = process_audio(audio_data)
+    emotions = []
+    for start in range(0, len(signals), INFER_BATCH_SIZE):
+        chunk = signals[start:start + INFER_BATCH_SIZE]
         
-        # Create spectogram
-        spectogram = create_spectogram(processed_audio)
+        # Map each file to its signal rows; a mono row is reused for every model channel.
+        # Unused batch slots repeat the first file and their predictions are dropped
+        channel_index = []
+        row = 0
+        for signal in chunk:
+            num_rows = signal.shape[0]
+            channel_index.append([row + min(channel, num_rows - 1) for channel in range(new_channel)])
+            row += num_rows
+        channel_index += [channel_index[0]] * (INFER_BATCH_SIZE - len(chunk))
+        channel_index = torch.tensor(channel_index, device=DEVICE)
         
-        # Prepare input for model
-        spectogram = spectogram.unsqueeze(0)  # Add batch dimension
+        # Fill a fixed-size pinned buffer so the copy to GPU is an async DMA transfer
+        # and the compiled graph always sees the same shape
+        batch = torch.empty((INFER_BATCH_SIZE * new_channel, MAX_LEN), pin_memory=DEVICE.type == "cuda")
+        torch.cat(chunk, out=batch[:row])
+        batch[row:].zero_()
         
-        # Move to device and normalize (same as in training)
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        spectogram = spectogram.to(device)
-        inputs_m, inputs_s = spectogram.mean(), spectogram.std()
-        spectogram = (spectogram - inputs_m) / inputs_s
+        # Move the raw waveforms to device so the STFT and mel projection run there
+        batch = batch.to(DEVICE, non_blocking=True)
         
-        # Get model prediction
-        with torch.no_grad():
-            outputs = MODEL(spectogram)
-            _, predicted = torch.max(outputs, 1)
-            predicted_emotion = EMOTION_LABELS[predicted.item()]
+        try:
+            with torch.inference_mode():
+                predicted = INFER(batch, channel_index)
+        except COMPILE_ERRORS as e:
+            # A recompile can still fail later on; use the TorchScript model from then on
+            print(f"Warning: Could not compile inference, using TorchScript model: {str(e)}")
+            INFER = trace_inference()
+            with torch.inference_mode():
+                predicted = INFER(batch, channel_index)
         
-        # Store the result
-        ANALYZED_FILES[audio_path] = predicted_emotion
+        emotions += [EMOTION_LABELS[index] for index in predicted[:len(chunk)].tolist()]
+    
+    return emotions
+
+def content_key(audio_data):
+    """
+    Hash the decoded audio, i.e. exactly the samples and sample rate the prediction depends on
+    """
+    hasher = xxhash.xxh3_64() if xxhash is not None else hashlib.blake2b(digest_size=8)
+    hasher.update(f"{audio_data.sample_rate}:{tuple(audio_data.signal.shape)}".encode())
+    # The decoded buffer is (time, channels); transposing back gives it without a copy
+    hasher.update(audio_data.signal.t().contiguous().numpy())
+    return hasher.hexdigest()
+
+def load_audio_file(audio_path):
+    """
+    Load and hash an audio file, and process it unless its content was already analyzed
+    
+    Returns the content key, the cached emotion (if any) and the processed audio (if not cached)
+    """
+    # Only the first max_ms are decoded, so hashing them is cheap and covers all the model sees
+    audio_data = open_audio_file(audio_path, max_ms)
+    key = content_key(audio_data)
+    
+    cached_emotion = ANALYZED_CONTENT.get(key)
+    if cached_emotion is not None:
+        return key, cached_emotion, None
+    
+    return key, None, process_audio(audio_data)
+
+def classify_audio_files(audio_paths):
+    """
+    Classify every not yet analyzed file with one batched model call
+    """
+    new_paths = [audio_path for audio_path in audio_paths if audio_path not in ANALYZED_FILES]
+    
+    # Load and hash files in parallel; soundfile releases the GIL while decoding
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = [executor.submit(load_audio_file, audio_path) for audio_path in new_paths]
+    
+    pending_paths = []
+    content_keys = []
+    signals = []
+    for audio_path, future in zip(new_paths, futures):
+        try:
+            key, cached_emotion, processed_audio = future.result()
+        except Exception as e:
+            print(f"Error in emotion classification: {str(e)}")
+            ANALYZED_FILES[audio_path] = random.choice(EMOTION_LABELS)
+            continue
         
-        print(f"Processed audio shape: {processed_audio.signal.shape}")
-        print(f"Processed sample rate: {processed_audio.sample_rate}Hz")
-        print(f"Spectogram shape: {spectogram.shape}")
-        print(f"Predicted emotion: {predicted_emotion}")
+        if cached_emotion is not None:
+            ANALYZED_FILES[audio_path] = cached_emotion
+            continue
         
-        return predicted_emotion
+        pending_paths.append(audio_path)
+        content_keys.append(key)
+        signals.append(processed_audio.signal)
+    
+    if signals:
+        try:
+            emotions = classify_signals(signals)
+        except Exception as e:
+            print(f"Error in emotion classification: {str(e)}")
+            emotions = [random.choice(EMOTION_LABELS) for _ in pending_paths]
+        else:
+            # Only real predictions are shared across files with the same content
+            for key, emotion in zip(content_keys, emotions):
+                ANALYZED_CONTENT[key] = emotion
         
-    except Exception as e:
-        print(f"Error in emotion classification: {str(e)}")
-        emotion = random.choice(EMOTION_LABELS)
-        ANALYZED_FILES[audio_path] = emotion
-        return emotion
+        for audio_path, emotion in zip(pending_paths, emotions):
+            ANALYZED_FILES[audio_path] = emotion
+            print(f"Predicted emotion for {audio_path}: {emotion}")
+    
+    return [ANALYZED_FILES[audio_path] for audio_path in audio_paths]
 
 def save_uploaded_file(audio):
     """
@@ -131,7 +289,12 @@ def save_uploaded_file(audio):
         return audio, "Audio recording saved successfully!"
     else:  # If audio is uploaded as a file
         try:
-            shutil.copy2(audio, output_path)
+            # Link instead of copying the bytes; a link into Gradio's cache could dangle,
+            # so copy when a hardlink is not possible (e.g. across filesystems)
+            try:
+                os.link(audio, output_path)
+            except OSError:
+                shutil.copy2(audio, output_path)
             return audio, "Audio file saved successfully!"
         except Exception as e:
             print(f"Error saving file: {e}")
@@ -145,16 +308,16 @@ def analyze_all_audios():
     if not temp_dir.exists():
         return "No audio files found! Please upload or record some audio first."
     
-    audio_files = list(temp_dir.glob("*.wav"))
+    # Single directory read, no per-entry stat or Path objects
+    with os.scandir(temp_dir) as entries:
+        audio_files = [entry for entry in entries if entry.name.endswith(".wav")]
     if not audio_files:
         return "No audio files found! Please upload or record some audio first."
     
-    # Analyze each audio file
+    # Analyze all audio files in one batch
+    emotions = classify_audio_files([audio_file.path for audio_file in audio_files])
     results = []
-    emotions = []
-    for audio_file in audio_files:
-        emotion = simulate_emotion_classification(str(audio_file))
-        emotions.append(emotion)
+    for audio_file, emotion in zip(audio_files, emotions):
         results.append(f"File: {audio_file.name} → Emotion: {emotion} (Stress Level: {EMOTION_WEIGHTS[emotion]:.1f})")
     
     # Calculate average stress level
@@ -184,6 +347,7 @@ def delete_temp_files():
                         del ANALYZED_FILES[str(file)]
                 except Exception as e:
                     print(f"Error deleting {file}: {e}")
+            ANALYZED_CONTENT.clear()
             return "✨ All audio files cleared successfully!"
         except Exception as e:
             print(f"Error clearing files: {e}")
@@ -79,4 +79,15 @@ def load_model(model_path):
         return model
     except Exception as e:
         print(f"Error loading model: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def optimize_model(model, example_input):
+    """
+    Trace and freeze the model for inference (strips autograd, folds batch norm into the convolutions)
+    """
+    try:
+        traced = torch.jit.trace(model.eval(), example_input)
+        return torch.jit.freeze(traced)
+    except Exception as e:
+        print(f"Could not optimize model, using eager model: {str(e)}")
+        return model
\ No newline at end of file
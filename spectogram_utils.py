@@ -1,9 +1,30 @@
+import functools
 import torch
 import torchaudio
-from torchaudio import transforms
 from audio_utils import AudioData
 
-def create_spectogram(audio_data: AudioData, n_mels=64, n_fft=1024, hop_len=None) -> torch.Tensor:
+@functools.lru_cache(maxsize=4)
+def _get_window(n_fft, device):
+    """
+    Build (once) the Hann window used by the STFT
+    """
+    return torch.hann_window(n_fft, device=device)
+
+@functools.lru_cache(maxsize=4)
+def _get_mel_fbanks(sample_rate, n_fft, n_mels, device):
+    """
+    Build (once) the mel filterbank matrix, transposed to (n_mels, n_freqs)
+    """
+    fbanks = torchaudio.functional.melscale_fbanks(
+        n_freqs=n_fft // 2 + 1,
+        f_min=0.0,
+        f_max=float(sample_rate // 2),
+        n_mels=n_mels,
+        sample_rate=sample_rate
+    )
+    return fbanks.T.contiguous().to(device)
+
+def create_spectogram(audio_data: AudioData, n_mels=64, n_fft=1024, hop_len=None, channel_index=None) -> torch.Tensor:
     """
     Create a mel spectogram from audio data
     
@@ -12,21 +33,38 @@ def create_spectogram(audio_data: AudioData, n_mels=64, n_fft=1024, hop_len=None
         n_mels: Number of mel filterbanks
         n_fft: Size of FFT
         hop_len: Length of hop between STFT windows
+        channel_index: Optional (batch, channels) index into the signal rows, so that
+            several output channels can share the mel spectogram of one row
         
     Returns:
         torch.Tensor: Mel spectogram in decibel scale
     """
     top_db = 80
 
-    # Compute the Mel spectrogram
-    spec = transforms.MelSpectrogram(
-        sample_rate=audio_data.sample_rate,
+    signal = audio_data.signal
+    device = signal.device
+    if hop_len is None:
+        hop_len = n_fft // 2
+
+    # Compute the power spectrogram (same settings as transforms.MelSpectrogram)
+    stft = torch.stft(
+        signal.reshape(-1, signal.shape[-1]),
         n_fft=n_fft,
         hop_length=hop_len,
-        n_mels=n_mels
-    )(audio_data.signal)
+        window=_get_window(n_fft, device),
+        return_complex=True
+    )
+    spec = stft.abs().pow_(2)
+    spec = spec.reshape(signal.shape[:-1] + spec.shape[-2:])
+
+    # Project onto the mel scale with a single matmul
+    spec = torch.matmul(_get_mel_fbanks(audio_data.sample_rate, n_fft, n_mels, device), spec)
+    if channel_index is not None:
+        spec = spec[channel_index]
 
-    # Convert the spectrogram to decibel scale
-    spec = transforms.AmplitudeToDB(top_db=top_db)(spec)
+    # Convert the spectrogram to decibel scale, clipped top_db below the peak of each sample
+    spec = 10.0 * torch.log10(torch.clamp(spec, min=1e-10))
+    peak_dims = (-3, -2, -1) if spec.dim() > 2 else (-2, -1)
+    spec = torch.maximum(spec, spec.amax(dim=peak_dims, keepdim=True) - top_db)
 
-    return spec 
\ No newline at end of file
+    return spec
\ No newline at end of file